@@ -4,14 +4,22 @@ pip install python-twitter
 Created by Juha Ylitalo <juha@ylitalot.net>
 License: MIT
 """
+# Lambda and cron deploy single file, so module is kept together.
+# pylint: disable=too-many-lines
 
 import argparse
+import cProfile
 import json
+import marshal
 import os
+import resource
+import signal
 import smtplib
 import sys
+import threading
 import time
 import traceback
+import tracemalloc
 
 from configparser import ConfigParser
 from email.mime.text import MIMEText
@@ -22,6 +30,16 @@ import requests
 import twitter
 import urllib3
 
+# Shared between reports, so that daemon mode keeps connections and
+# already resolved short URLs warm.
+HTTP = requests.Session()
+URL_CACHE = {}
+URL_CACHE_SIZE = 10000
+DEFAULT_INTERVAL = 86400
+TIMELINE_URL = 'https://api.twitter.com/1.1/statuses/user_timeline.json'
+CREDENTIALS = ['access_token_key', 'access_token_secret',
+               'consumer_key', 'consumer_secret']
+
 
 class TwitterBot(object):
     """
@@ -33,11 +51,69 @@ class TwitterBot(object):
         Init instance variables.
         """
         self.__api = None
+        self.__smtp = None
         self._cf = config
         self.debug = config.getboolean('api', 'debug', fallback=False)
-        self._started = time.time()
+        self.daemon = False
         self.__max_items = 100
 
+    def reload(self, config):
+        """
+        Take new configuration into use.
+        Twitter API client is recreated only if api section changed.
+        """
+        if api_config(config) != api_config(self._cf):
+            self.__api = None
+            self.close()
+        self._cf = config
+        self.debug = config.getboolean('api', 'debug', fallback=False)
+
+    def close(self):
+        """
+        Close SMTP connection (if one is open).
+        """
+        # pylint: disable=broad-except
+        if self.__smtp:
+            try:
+                self.__smtp.quit()
+            except Exception:
+                pass
+            self.__smtp = None
+
+    def interval(self, topic):
+        """
+        Seconds between reports on topic.
+        """
+        return self._interval(topic, self._interval('api', DEFAULT_INTERVAL))
+
+    def _interval(self, section, default):
+        """
+        Interval option from section.
+        Invalid value is logged and default is used instead.
+        """
+        error = self._interval_error(section)
+        if error:
+            log_error("%s, using %d seconds." % (error, default))
+            return default
+        return self._cf.getint(section, 'interval', fallback=default)
+
+    def _interval_error(self, section):
+        """
+        Describe problem with interval option in section (None if valid).
+        """
+        try:
+            if self._cf.getint(section, 'interval', fallback=1) > 0:
+                return None
+            return section + " has non-positive interval"
+        except ValueError:
+            return section + " has non-numeric interval"
+
+    def topics(self):
+        """
+        Topics in configuration file.
+        """
+        return topics(self._cf.sections())
+
     def validate_config(self):
         """
         Validate TwitterBot configuration.
@@ -45,9 +121,15 @@ class TwitterBot(object):
         If errors were found, return list of findings
         """
         errors = []
-        # Validate Twitter API section
+        # Validate Twitter API section(s)
         if self._cf.has_section('api'):
-            errors = validate_api_config(self._cf.options('api'))
+            pools = api_sections(self._cf.sections())[1:]
+            errors = validate_api_config(self._cf.options('api'), pools)
+            for section in pools:
+                errors.extend(validate_credentials(
+                    section, self._cf.options(section)))
+            if self._interval_error('api'):
+                errors += [self._interval_error('api')]
         else:
             errors = ['api section missing from configuration file']
         if errors:
@@ -59,46 +141,71 @@ class TwitterBot(object):
 
     def _api(self):
         """
-        Get handler for Twitter API.
+        Get handler for Twitter API (pool of clients).
         """
         if not self.__api:
-            self.__api = twitter.Api(
-                access_token_key=self._cf.get('api', 'access_token_key'),
-                access_token_secret=self._cf.get('api', 'access_token_secret'),
-                consumer_key=self._cf.get('api', 'consumer_key'),
-                consumer_secret=self._cf.get('api', 'consumer_secret'),
-                tweet_mode='extended')
+            credentials = dict(
+                (section, dict(self._cf.items(section)))
+                for section in api_sections(self._cf.sections())
+                if set(CREDENTIALS) <= set(self._cf.options(section)))
+            self.__api = ApiPool(credentials)
         return self.__api
 
-    def _tweets(self, twitter_user, remove):
+    def _smtp(self):
+        """
+        Get connection to SMTP server.
+        Existing connection is reused, if server still answers.
+        """
+        if self.__smtp:
+            try:
+                self.__smtp.noop()
+            except (smtplib.SMTPException, OSError):
+                self.__smtp = None
+        if not self.__smtp:
+            smtp = smtplib.SMTP(self._cf.get('api', 'smtp_host'),
+                                self._cf.get('api', 'smtp_port'))
+            if self._cf.has_option('api', 'smtp_user'):
+                smtp.login(self._cf.get('api', 'smtp_user'),
+                           self._cf.get('api', 'smtp_password'))
+            self.__smtp = smtp
+        return self.__smtp
+
+    def _tweets(self, twitter_user, remove, index, since):
         """
         Fetch unique tweets from single Twitter account.
         """
         report = []
         if self.debug:
             print("Fetching %s timeline." % (twitter_user))
-        # 86400s => 1 day
-        tweet_filter = TweetFilter(remove, self._started - 86400)
-        tweets = self._api().GetUserTimeline(
+        tweet_filter = TweetFilter(remove, since, index, twitter_user)
+        tweets = self._api().timeline(
             screen_name=twitter_user, count=self.__max_items, trim_user=True,
             include_rts=False, exclude_replies=True)
         for tweet in tweets:
-            text = tweet_filter.clean_tweet(tweet)
+            text = tweet_filter.strip_tweet(tweet)
+            # drop obvious duplicates before following any links
+            if not tweet_filter.is_unique_key(text, tweet_urls(tweet)):
+                continue
+            text = tweet_filter.expand_links(tweet, text)
             if tweet_filter.is_unique(text):
                 report += [(tweet.created_at_in_seconds, text)]
-        report += [(tweet_filter.uniques(), tweet_filter.duplicates())]
+        report += [(tweet_filter.uniques(), tweet_filter.duplicates(),
+                    tweet_filter.cross_duplicates())]
         return report
 
-    def _twitter_user_summary(self, found, skipped):
+    def _twitter_user_summary(self, found, skipped, cross_skipped=0):
         """
         Statistics about how many tweets were found, skipped as duplicate, etc.
         """
-        total_items = found + skipped
+        total_items = found + skipped + cross_skipped
         msg = []
         if self.__max_items == total_items:
             msg += ['Max number of tweets (%d) fetched.' % (total_items)]
         msg += ['Summary: %d tweets found' % (total_items)]
-        if skipped:
+        if cross_skipped:
+            msg[-1] += (': %d unique, %d duplicates and %d duplicates of '
+                        'other users.' % (found, skipped, cross_skipped))
+        elif skipped:
             msg[-1] += ': %d unique and %d duplicates.' % (found, skipped)
         return '\n'.join(msg)
 
@@ -109,13 +216,14 @@ class TwitterBot(object):
         users, text = email_heading(list(report.keys()))
         tweets_found = False
         for user in users:
-            found, skipped = report[user].pop(-1)
+            found, skipped, cross_skipped = report[user].pop(-1)
             if not found:
                 continue
             text += twitter_user_heading(user)
             for tweet in report[user]:
                 text += tweet_message(tweet[0], tweet[1])
-            text += [self._twitter_user_summary(found, skipped), '']
+            text += [self._twitter_user_summary(found, skipped, cross_skipped),
+                     '']
             tweets_found = True
         if not tweets_found:
             return None
@@ -135,45 +243,62 @@ class TwitterBot(object):
         if self.debug:
             print(msg.as_string())
         else:
-            smtp = smtplib.SMTP(self._cf.get('api', 'smtp_host'),
-                                self._cf.get('api', 'smtp_port'))
-            if self._cf.has_option('api', 'smtp_user'):
-                smtp.login(self._cf.get('api', 'smtp_user'),
-                           self._cf.get('api', 'smtp_password'))
-            smtp.sendmail(sender, you.split(','), msg.as_string())
-            smtp.quit()
+            self._smtp().sendmail(sender, you.split(','), msg.as_string())
+            if not self.daemon:
+                self.close()
 
     def _handle_topic(self, topic):
         """
         Handle topic from configuration file.
         """
         # pylint: disable=broad-except
+        profiler = Profiler(self._cf.get('api', 'profile', fallback=''), topic)
         try:
+            profiler.start()
             start_time = time.time()
+            calls = dict(self._api().calls)
+            # outside daemon mode cron or CloudWatch runs topics daily
+            since = start_time - (
+                self.interval(topic) if self.daemon else DEFAULT_INTERVAL)
             report = {}
             remove = filters(topic, self._cf)
+            # tweets seen within topic, shared by all users in topic
+            index = {}
             for twitter_user in self._cf.get(topic, 'users').split(','):
-                report[twitter_user] = self._tweets(twitter_user, remove)
+                report[twitter_user] = self._tweets(twitter_user, remove,
+                                                    index, since)
             msg = self._email_text(report)
             if msg:
                 sender = self._cf.get('api', 'mail_from')
                 self._send_email(sender, topic, msg)
             end_time = time.time()
             log("%s topic took %.1f seconds" % (topic, end_time - start_time))
+            log("%s topic API calls: %s" %
+                (topic, self._api().summary(calls)))
         except Exception as problem:
             log_error_with_stack(
                 "Problem with %s topic. Details are:\n%s" %
                 (topic, str(problem))
             )
+        finally:
+            profiler.stop()
 
-    def make_reports(self):
+    def make_reports(self, selected=None):
         """
         Main method.
         Read config, fetch tweets, form report and send it to recipients.
+        In daemon mode topics are handled in this process,
+        so that API client, connections and caches stay warm.
         """
         # pylint: disable=broad-except
+        if selected is None:
+            selected = self.topics()
+        if self.daemon:
+            for topic in selected:
+                self._handle_topic(topic)
+            return
         pids = []
-        for topic in topics(self._cf.sections()):
+        for topic in selected:
             try:
                 pid = Process(target=self._handle_topic, args=(topic,))
                 pids += [pid]
@@ -201,34 +326,104 @@ class TwitterBot(object):
         missing_options.sort()
         for missing in missing_options:
             errors += [topic + " doesn't have " + missing]
+        if self._interval_error(topic):
+            errors += [self._interval_error(topic)]
         if 'users' in missing_options:
             return errors
         for user in self._cf.get(topic, 'users').split(','):
             try:
-                self._api().GetUserTimeline(screen_name=user, count=1)
+                self._api().timeline(screen_name=user, count=1)
             except twitter.error.TwitterError as twit_error:
                 msg = "[%s,users] %s => %s"
                 errors += [msg % (topic, user, str(twit_error))]
         return errors
 
 
+class ApiPool(object):
+    """
+    Twitter API clients for one or more credential sets.
+    Timeline requests go to client with most remaining quota.
+    """
+    def __init__(self, credentials):
+        """
+        Create client for every credential set (section name => options).
+        """
+        self._clients = {}
+        for name, options in credentials.items():
+            self._clients[name] = twitter.Api(
+                access_token_key=options['access_token_key'],
+                access_token_secret=options['access_token_secret'],
+                consumer_key=options['consumer_key'],
+                consumer_secret=options['consumer_secret'],
+                tweet_mode='extended')
+        self.calls = dict.fromkeys(self._clients, 0)
+
+    def _remaining(self, name):
+        """
+        Remaining timeline requests for client in current rate limit window.
+        Limits are read from headers of earlier responses (never requested
+        separately), so unused clients are preferred.
+        Limit with passed reset time counts as full quota.
+        """
+        # pylint: disable=broad-except
+        if not self.calls[name]:
+            return (True, 0)
+        remaining = -self.calls[name]
+        try:
+            limit = self._clients[name].rate_limit.get_limit(TIMELINE_URL)
+            if int(limit.limit):
+                remaining = int(limit.remaining)
+                if int(limit.reset) <= time.time():
+                    remaining = int(limit.limit)
+        except Exception:
+            pass
+        return (False, remaining)
+
+    def _client(self):
+        """
+        Pick client for next request and account the call for it.
+        """
+        name = max(sorted(self._clients), key=self._remaining)
+        self.calls[name] += 1
+        return self._clients[name]
+
+    def summary(self, before=None):
+        """
+        Number of calls made with each credential set
+        (since before, which is earlier copy of calls).
+        """
+        before = before if before else {}
+        return ', '.join('%s=%d' % (name, self.calls[name] -
+                                    before.get(name, 0))
+                         for name in sorted(self.calls))
+
+    def timeline(self, **kwargs):
+        """
+        GetUserTimeline through least used client.
+        """
+        return self._client().GetUserTimeline(**kwargs)
+
+
 class TweetFilter(object):
     """
     Filter tweets.
     """
-    def __init__(self, remove, timespan):
+    def __init__(self, remove, timespan, index=None, user=None):
         """
         Set instances variables for filtering actions.
         """
-        self._uniq_text = set()
         self.remove = remove
         self.timespan = timespan
+        self.user = user
+        self._index = {} if index is None else index
+        self._uniques = 0
         self._duplicates = 0
+        self._cross_duplicates = 0
 
-    def clean_tweet(self, tweet):
+    def strip_tweet(self, tweet):
         """
-        Clean unnecessary stuff out from tweet and
-        dig final destination of URLs.
+        Remove old tweets, spam and unnecessary text from tweet.
+        Links are left untouched.
         """
         if tweet.created_at_in_seconds < self.timespan:
             return ''
@@ -237,6 +432,12 @@ class TweetFilter(object):
         for spam in self.remove['tweets']:
             if spam in text:
                 return ''
+        return text
+
+    def expand_links(self, tweet, text):
+        """
+        Dig final destination of URLs in (already stripped) tweet.
+        """
         ret = []
         has_links = False
         for word in text.split(' '):
@@ -252,6 +453,12 @@ class TweetFilter(object):
                 ret += [word]
         return ' '.join(ret)
 
+    def cross_duplicates(self):
+        """
+        Getter
+        """
+        return self._cross_duplicates
+
     def duplicates(self):
         """
         Getter
@@ -262,7 +469,47 @@ class TweetFilter(object):
         """
         Getter
         """
-        return len(self._uniq_text)
+        return self._uniques
+
+    def _is_duplicate(self, kind, value):
+        """
+        Check value from topic index and count duplicates
+        separately for this user and other users.
+        """
+        if (kind, value) not in self._index:
+            self._index[(kind, value)] = self.user
+            return False
+        owner = self._index[(kind, value)]
+        if owner == self.user:
+            self._duplicates += 1
+        else:
+            self._cross_duplicates += 1
+        return True
+
+    def is_unique_key(self, text, urls=None):
+        """
+        Check if text (before URL expansion) can still be unique tweet.
+        Short URLs are replaced with URLs that Twitter already expanded
+        (urls), so tweets with same wording, but different links survive
+        and same link behind different short URLs is duplicate.
+
+        >>> tweet_filter = TweetFilter({}, 0)
+        >>> tweet_filter.is_unique_key('New post: https://t.co/a',
+        ...                            {'https://t.co/a': 'http://x.org/1'})
+        True
+        >>> tweet_filter.is_unique_key('New post: https://t.co/b',
+        ...                            {'https://t.co/b': 'http://x.org/2'})
+        True
+        >>> tweet_filter.is_unique_key('https://t.co/c')
+        True
+        >>> tweet_filter.is_unique_key('https://t.co/d')
+        True
+        >>> tweet_filter.is_unique_key('New post: https://t.co/e',
+        ...                            {'https://t.co/e': 'http://x.org/1'})
+        False
+        """
+        key = text_key(text, urls)
+        return bool(key) and not self._is_duplicate('key', key)
 
     def is_unique(self, text):
         """
@@ -271,30 +518,215 @@ class TweetFilter(object):
         text = text.strip()
         if text.endswith('.'):
             text = text[:-1]
-        if text:
-            if text in self._uniq_text:
-                self._duplicates += 1
-            else:
-                self._uniq_text.add(text)
-                return True
+        if text and not self._is_duplicate('text', text):
+            self._uniques += 1
+            return True
         return False
 
 
+class Profiler(object):
+    """
+    CPU profile and memory allocations of single topic.
+    Results are written into local directory or S3 prefix (s3://...).
+    """
+    def __init__(self, target, topic, top_allocations=25):
+        """
+        Set instance variables. Empty target disables profiling.
+        """
+        self.target = target
+        self.topic = topic
+        self.top_allocations = top_allocations
+        self._profile = None
+
+    def start(self):
+        """
+        Start cProfile and tracemalloc.
+        """
+        if not self.target:
+            return
+        tracemalloc.start()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self):
+        """
+        Stop profiling, write results and log summary.
+        """
+        # pylint: disable=broad-except
+        if not self._profile:
+            return
+        self._profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # ru_maxrss is in kilobytes on Linux
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        prefix = '%s-%s' % (self.topic, time.strftime('%Y%m%dT%H%M%S'))
+        stats = snapshot.statistics('lineno')[:self.top_allocations]
+        try:
+            self._profile.create_stats()
+            write_output(self.target, prefix + '.prof',
+                         marshal.dumps(self._profile.stats))
+            write_output(self.target, prefix + '.alloc.txt',
+                         '\n'.join(str(stat) for stat in stats).encode())
+        except Exception as problem:
+            log_error_with_stack(
+                "Problem with writing %s profile. Details are:\n%s" %
+                (self.topic, str(problem))
+            )
+        self._profile = None
+        log("%s topic peak RSS %.1f MB, peak traced %.1f MB" %
+            (self.topic, max_rss / 1024.0, peak / 1048576.0))
+
+
+class Daemon(object):
+    """
+    Keep TwitterBot running and report each topic on its own interval.
+    """
+    # command line options, config version and schedule state
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, cf_file, debug=False, profile=None, state=None):
+        """
+        Load configuration and schedule topics.
+        Topics without earlier run in state file run immediately.
+        """
+        self.cf_file = cf_file
+        self.debug = debug
+        self.profile = profile
+        self.state = state
+        self.bot = TwitterBot(self._read_config())
+        self._version = config_version(cf_file)
+        self.bot.daemon = True
+        self._last = self._load_state()
+        self._due = {}
+        self._stop = threading.Event()
+        self._schedule()
+
+    def _load_state(self):
+        """
+        Read last run time of each topic from state file.
+        """
+        # pylint: disable=broad-except
+        if not self.state or not os.path.exists(self.state):
+            return {}
+        try:
+            with open(self.state, encoding='utf-8') as state:
+                return json.load(state)
+        except Exception as problem:
+            log_error("Unable to read %s: %s" % (self.state, str(problem)))
+            return {}
+
+    def _save_state(self):
+        """
+        Write last run time of each topic into state file.
+        """
+        # pylint: disable=broad-except
+        if not self.state:
+            return
+        try:
+            with open(self.state + '.tmp', 'w', encoding='utf-8') as state:
+                json.dump(self._last, state)
+            os.rename(self.state + '.tmp', self.state)
+        except Exception as problem:
+            log_error("Unable to write %s: %s" % (self.state, str(problem)))
+
+    def _read_config(self):
+        """
+        Read configuration file with command line overrides.
+        """
+        config = get_config(self.cf_file)
+        if self.debug:
+            config.set('api', 'debug', str(self.debug))
+        if self.profile:
+            config.set('api', 'profile', self.profile)
+        return config
+
+    def _reload(self):
+        """
+        Reload configuration file, if it has changed.
+        """
+        # pylint: disable=broad-except
+        try:
+            version = config_version(self.cf_file)
+            if version == self._version:
+                return
+            self.bot.reload(self._read_config())
+            self._version = version
+            log("Configuration reloaded from %s" % (self.cf_file))
+            self._schedule()
+        except Exception as problem:
+            log_error_with_stack(
+                "Problem with reloading %s. Details are:\n%s" %
+                (self.cf_file, str(problem))
+            )
+
+    def _schedule(self):
+        """
+        Schedule topics from their last run and current interval.
+        Topics that haven't run yet are due now.
+        """
+        now = time.time()
+        due = {}
+        for topic in self.bot.topics():
+            if topic in self._last:
+                due[topic] = self._last[topic] + self.bot.interval(topic)
+            else:
+                due[topic] = now
+        self._due = due
+
+    def stop(self, *_):
+        """
+        Ask daemon to stop after current topic.
+        """
+        log("Stopping TwitterBot daemon.")
+        self._stop.set()
+
+    def run(self):
+        """
+        Run due topics until stopped.
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self._stop.is_set():
+            self._reload()
+            for topic in sorted(self._due, key=self._due.get):
+                now = time.time()
+                if self._stop.is_set() or self._due[topic] > now:
+                    continue
+                self.bot.make_reports([topic])
+                self._last[topic] = now
+                self._save_state()
+                interval = self.bot.interval(topic)
+                due = self._due[topic] + interval
+                if due <= time.time():
+                    due = time.time() + interval
+                self._due[topic] = due
+            # wake up at least once a minute to check configuration changes
+            wait = min(list(self._due.values()) + [time.time() + 60])
+            self._stop.wait(max(wait - time.time(), 0))
+        self.bot.close()
+
+
 def extend_url(word, text):
     """
     Take shorten url and go through all redirects to find final destination.
     """
     # pylint: disable=broad-except
+    if word in URL_CACHE:
+        return URL_CACHE[word]
     url = word
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
     try:
         for _ in range(10):
-            headers = requests.head(
+            headers = HTTP.head(
                 url, allow_redirects=False, verify=False, timeout=5).headers
             if 'location' in headers and is_http_link(headers['location']):
                 url = headers['location']
             else:
                 break
+        if len(URL_CACHE) >= URL_CACHE_SIZE:
+            URL_CACHE.clear()
+        URL_CACHE[word] = url
     except requests.exceptions.ConnectionError as problem:
         log_error("""ConnectionError:
 Tweet was %s
@@ -310,6 +742,36 @@ URL was %s""" % (str(problem), text, word, url))
     return url
 
 
+def tweet_urls(tweet):
+    """
+    Short URLs of tweet mapped to URLs expanded by Twitter.
+    """
+    return dict((url.url, url.expanded_url)
+                for url in getattr(tweet, 'urls', None) or []
+                if url.url and url.expanded_url)
+
+
+def text_key(text, urls=None):
+    """
+    Normalize tweet (before URL expansion) into cheap deduplication key.
+    Short URLs found from urls are replaced with their expanded URLs.
+
+    >>> text_key('Read this: https://t.co/abc  now.')
+    'Read this: https://t.co/abc now'
+    >>> text_key('Read this: https://t.co/abc',
+    ...          {'https://t.co/abc': 'https://example.com/'})
+    'Read this: https://example.com/'
+    >>> text_key('')
+    ''
+    """
+    urls = urls if urls else {}
+    key = ' '.join(urls.get(word, word)
+                   for word in text.split(' ') if word).strip()
+    if key.endswith('.'):
+        key = key[:-1]
+    return key
+
+
 def is_true(string):
     """
     Given string is a word yes or true in lowercase, uppercase or mixture.
@@ -333,14 +795,39 @@ def filters(topic, config):
 
 def topics(sections):
     """
-    Sort possible topics list and remove 'api',
+    Sort possible topics list and remove 'api' (and 'api:...'),
     since it has twitter credentials etc.
+
+    >>> topics(['b', 'api', 'api:1', 'a'])
+    ['a', 'b']
     """
-    sections.remove('api')
+    sections = [section for section in sections
+                if section not in api_sections(sections)]
     sections.sort()
     return sections
 
 
+def api_sections(sections):
+    """
+    Sections with Twitter API credentials: 'api' and sorted 'api:...'.
+
+    >>> api_sections(['b', 'api:2', 'api', 'api:1'])
+    ['api', 'api:1', 'api:2']
+    """
+    pools = [section for section in sections if section.startswith('api:')]
+    pools.sort()
+    return ['api'] + pools
+
+
+def api_config(config):
+    """
+    Options of all API sections in configuration.
+    """
+    return [dict(config.items(section))
+            for section in api_sections(config.sections())
+            if config.has_section(section)]
+
+
 def is_http_link(url):
     """
     is url is valid http or https link?
@@ -429,13 +916,15 @@ def twitter_user_heading(user):
     return [line, '*'*len(line)]
 
 
-def validate_api_config(options):
+def validate_api_config(options, pools=None):
     """
-    Validate twitter API configuration (and mail_from option)
+    Validate twitter API configuration (and mail_from option).
+    Credentials are optional in api section, if api:... sections exist.
     """
-    mandatory = ['access_token_key', 'access_token_secret',
-                 'consumer_key', 'consumer_secret', 'mail_from',
-                 'smtp_host', 'smtp_port']
+    mandatory = ['mail_from', 'smtp_host', 'smtp_port']
+    # partial credential set is an error, even if api:... sections exist
+    if not pools or set(CREDENTIALS) & set(options):
+        mandatory += CREDENTIALS
     missing_options = list(set(mandatory) - set(options))
     missing_options.sort()
     errors = []
@@ -444,6 +933,16 @@ def validate_api_config(options):
     return errors
 
 
+def validate_credentials(section, options):
+    """
+    Validate api:... section with additional credential set.
+    """
+    missing_options = list(set(CREDENTIALS) - set(options))
+    missing_options.sort()
+    return ['%s is missing from %s section.' % (option, section)
+            for option in missing_options]
+
+
 def cmd_args():
     """
     Command line arguments for TwitterBot
@@ -455,9 +954,43 @@ def cmd_args():
                         help='print report instead of sending e-mail')
     parser.add_argument('--validate', action='store_true',
                         help='validate configuration file')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running and report topics on interval')
+    parser.add_argument('--state', default='.twitbot.state',
+                        help='file for last run times in daemon mode')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='write per topic profiles into directory '
+                        '(or s3://bucket/prefix)')
     return parser
 
 
+def write_output(target, name, body):
+    """
+    Write body (bytes) as name into local directory or S3 prefix.
+    """
+    if target.startswith('s3://'):
+        bucket = target[5:].split('/', 1)[0]
+        key = target[5:][len(bucket)+1:].rstrip('/')
+        key = key + '/' + name if key else name
+        boto3.client('s3').put_object(Bucket=bucket, Key=key, Body=body)
+    else:
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        with open(os.path.join(target, name), 'wb') as output:
+            output.write(body)
+
+
+def config_version(cf_file):
+    """
+    Value that changes whenever configuration file changes.
+    """
+    if cf_file.startswith('s3://'):
+        bucket = cf_file[5:cf_file.find('/', 5)]
+        key = cf_file[cf_file.find('/', 5)+1:]
+        return boto3.client('s3').head_object(Bucket=bucket, Key=key)['ETag']
+    return os.path.getmtime(cf_file)
+
+
 def get_config(cf_file):
     """
     Read configuration file.
@@ -476,6 +1009,48 @@ def get_config(cf_file):
     return config
 
 
+def set_credentials(config, credentials):
+    """
+    Set credential options (option => value). Comma-separated values are
+    split into api:1, api:2, ... sections.
+
+    >>> config = ConfigParser()
+    >>> config.read_string('[api]')
+    >>> set_credentials(config, {})
+    >>> config.sections()
+    ['api']
+    >>> set_credentials(config, {'consumer_key': 'k'})
+    >>> config.get('api', 'consumer_key')
+    'k'
+    >>> pool = dict((option, 'a,b') for option in CREDENTIALS)
+    >>> set_credentials(config, pool)
+    >>> config.sections()
+    ['api', 'api:1', 'api:2']
+    >>> config.get('api:2', 'access_token_secret')
+    'b'
+    >>> set_credentials(config, {'consumer_key': 'a,b'})  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    AssertionError: All TWITTER_* variables are needed ...
+    """
+    counts = set(len(value.split(',')) for value in credentials.values())
+    assert len(counts) <= 1, \
+        'TWITTER_* variables have different number of credential sets.'
+    if counts - set([1]):
+        assert set(credentials) == set(CREDENTIALS), \
+            'All TWITTER_* variables are needed for multiple credential sets.'
+    for option, value in credentials.items():
+        values = value.split(',')
+        if len(values) == 1:
+            config.set('api', option, value)
+            continue
+        for index, part in enumerate(values, 1):
+            section = 'api:%d' % (index)
+            if not config.has_section(section):
+                config.add_section(section)
+            config.set(section, option, part.strip())
+
+
 # pylint: disable=unused-argument
 def lambda_handler(event, context):
     """
@@ -484,22 +1059,29 @@ def lambda_handler(event, context):
     cf_file = os.environ['CONFIG'] if 'CONFIG' in os.environ else 'twitbot.cf'
     config = get_config(cf_file)
     config.set('api', 'debug', 'False')
+    credentials = {}
     for key in os.environ:
         if key.startswith('SMTP_'):
             config.set('api', key.lower(), os.environ[key])
         elif key.startswith('TWITTER_'):
-            config.set('api', key.lower().split('_', 1)[1], os.environ[key])
-        elif key == 'DEBUG':
+            credentials[key.lower().split('_', 1)[1]] = os.environ[key]
+        elif key in ['DEBUG', 'PROFILE']:
             config.set('api', key.lower(), os.environ[key])
+    set_credentials(config, credentials)
     TwitterBot(config).make_reports()
     return True
 
 
 if __name__ == '__main__':
     ARGS = cmd_args().parse_args(sys.argv[1:])
+    if ARGS.daemon and not ARGS.validate:
+        Daemon(ARGS.config, ARGS.debug, ARGS.profile, ARGS.state).run()
+        sys.exit(0)
     CONFIG = get_config(ARGS.config)
     if ARGS.debug:
         CONFIG.set('api', 'debug', str(ARGS.debug))
+    if ARGS.profile:
+        CONFIG.set('api', 'profile', ARGS.profile)
     BOT = TwitterBot(CONFIG)
     if ARGS.validate:
         ERRORS = BOT.validate_config()